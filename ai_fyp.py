@@ -1,24 +1,34 @@
 # Import necessary libraries
 import streamlit as st
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import plotly.express as px
-from ydata_profiling import ProfileReport
+import plotly.graph_objects as go
+import numpy as np
 import tempfile
 import os
-from together import Together
+import io
+import re
+import hashlib
+import asyncio
+import threading
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from cachetools import LRUCache, TTLCache
+from together import Together, AsyncTogether
 import pdfplumber
 
-# Check for required dependencies
+# LTTB downsampling for long line charts; evenly spaced points are used without it
 try:
-    import openpyxl
+    from tsdownsample import MinMaxLTTBDownsampler
 except ImportError:
-    st.warning("The 'openpyxl' package is required for Excel file support. Installing now...")
-    import subprocess
-    import sys
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "openpyxl"])
-    import openpyxl
+    MinMaxLTTBDownsampler = None
+
+# PyMuPDF extracts text much faster than pdfplumber; fall back when it is missing
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
 
 # Set page config
 st.set_page_config(
@@ -28,44 +38,689 @@ st.set_page_config(
 )
 
 # Initialize Together API - CORRECT INITIALIZATION METHOD
-try:
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """Create the Together AI client once and share it across reruns"""
     together_api = st.secrets.get("TOGETHER_API_KEY", "your-api-key-here")
     client = Together()
     client.api_key = together_api  # Correct way to set API key in current version
+    return client
+
+try:
+    client = get_client()
 except Exception as e:
     st.error(f"Failed to initialize Together AI client: {e}")
     st.stop()
 
-def call_llama2(prompt):
+LLM_MODEL = "meta-llama/Llama-3-70b-chat-hf"
+LLM_PARAMS = dict(
+    max_tokens=1024,
+    temperature=0.3,
+    top_k=50,
+    repetition_penalty=1,
+    stop=["<|endoftext|>"],
+    top_p=0.7
+)
+
+@st.cache_resource(show_spinner=False)
+def response_cache():
+    """LLM responses keyed on (model, prompt), shared across reruns for an hour"""
+    # Sessions run on separate threads, so access goes through the lock
+    return TTLCache(maxsize=256, ttl=3600), threading.Lock()
+
+def cached_response(prompt, model):
+    """Previously returned response for this prompt and model, if any"""
+    cache, lock = response_cache()
+    with lock:
+        return cache.get((model, prompt))
+
+def store_response(prompt, model, text):
+    """Remember a completed response for identical prompts"""
+    cache, lock = response_cache()
+    with lock:
+        cache[(model, prompt)] = text
+
+def cached_llama2(prompt, model):
+    """Completion served from the response cache when the prompt was seen before"""
+    text = cached_response(prompt, model)
+    if text is not None:
+        return text
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        stream=False,
+        **LLM_PARAMS
+    )
+    if hasattr(response, 'choices') and response.choices:
+        text = response.choices[0].message.content
+        store_response(prompt, model, text)
+        return text
+    return "No response from AI."
+
+def call_llama2(prompt, model=LLM_MODEL):
     """Function to call the Together AI LLama2 model with improved error handling"""
     try:
-        response = client.chat.completions.create(
-            model="meta-llama/Llama-3-70b-chat-hf",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=1024,
-            temperature=0.3,
-            top_k=50,
-            repetition_penalty=1,
-            stop=["<|endoftext|>"],
-            top_p=0.7,
-            stream=False
-        )
-        if hasattr(response, 'choices') and response.choices:
-            return response.choices[0].message.content
-        return "No response from AI."
+        return cached_llama2(prompt, model)
+    except Exception as e:
+        st.error(f"AI API Error: {str(e)}")
+        return None
+
+def stream_llama2(prompt, model=LLM_MODEL):
+    """Yield response tokens as they are generated"""
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        **LLM_PARAMS
+    )
+    for chunk in response:
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
+def write_llama2_stream(prompt, model=LLM_MODEL):
+    """Render a streamed response as it arrives and return the full text"""
+    text = cached_response(prompt, model)
+    if text is not None:
+        st.markdown(text)
+        return text
+    try:
+        text = st.write_stream(stream_llama2(prompt, model))
     except Exception as e:
         st.error(f"AI API Error: {str(e)}")
         return None
+    if isinstance(text, str) and text:
+        store_response(prompt, model, text)
+    return text
+
+async def acall_llama2(async_client, prompt, model=LLM_MODEL):
+    """Awaitable completion call so independent prompts can be in flight together"""
+    text = cached_response(prompt, model)
+    if text is not None:
+        return text
+    response = await async_client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        stream=False,
+        **LLM_PARAMS
+    )
+    if hasattr(response, 'choices') and response.choices:
+        text = response.choices[0].message.content
+        store_response(prompt, model, text)
+        return text
+    return "No response from AI."
+
+# Upper bound on requests in flight at once, to stay under the API rate limit
+MAX_CONCURRENT_REQUESTS = 8
+
+def gather_llama2(prompts, model=LLM_MODEL):
+    """Issue independent prompts concurrently and return the responses in order"""
+    async def gather():
+        limit = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        
+        async def limited_call(async_client, prompt):
+            async with limit:
+                return await acall_llama2(async_client, prompt, model)
+        
+        # The async client is bound to this event loop, so it is not cached
+        async with AsyncTogether(api_key=client.api_key) as async_client:
+            return await asyncio.gather(
+                *(limited_call(async_client, p) for p in prompts),
+                return_exceptions=True
+            )
+    
+    responses = []
+    for result in asyncio.run(gather()):
+        if isinstance(result, Exception):
+            st.error(f"AI API Error: {str(result)}")
+            responses.append(None)
+        else:
+            responses.append(result)
+    return responses
+
+# Roughly 6k tokens at ~4 characters per token
+BATCH_PROMPT_CHAR_LIMIT = 24000
+
+def batch_llama2(prompts, model=LLM_MODEL):
+    """Send independent prompts in a single request and split the numbered reply"""
+    responses = {i: cached_response(p, model) for i, p in enumerate(prompts, start=1)}
+    pending = [i for i, text in responses.items() if text is None]
+    
+    if len(pending) >= 2 and sum(len(prompts[i - 1]) for i in pending) <= BATCH_PROMPT_CHAR_LIMIT:
+        batched_prompt = (
+            "Answer each of the following prompts independently. "
+            "Start the answer to PROMPT i with a line '### RESPONSE i ###' and "
+            "do not add any text outside these response blocks."
+        )
+        for number, i in enumerate(pending, start=1):
+            batched_prompt += f"\n\n### PROMPT {number} ###\n{prompts[i - 1]}"
+        
+        reply, truncated = None, False
+        try:
+            # Each answer keeps the token budget it would have had on its own
+            response = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": batched_prompt}],
+                stream=False,
+                **dict(LLM_PARAMS, max_tokens=LLM_PARAMS["max_tokens"] * len(pending))
+            )
+            if hasattr(response, 'choices') and response.choices:
+                reply = response.choices[0].message.content
+                truncated = getattr(response.choices[0], 'finish_reason', None) == "length"
+        except Exception as e:
+            st.error(f"AI API Error: {str(e)}")
+        
+        if reply:
+            blocks = {}
+            parts = re.split(r"###\s*RESPONSE\s+(\d+)\s*###", reply)
+            for number, text in zip(parts[1::2], parts[2::2]):
+                number = int(number)
+                if 1 <= number <= len(pending) and text.strip():
+                    blocks[number] = text.strip()
+            if truncated and blocks:
+                # The reply hit the token limit, so its last block is cut off
+                blocks.pop(max(blocks))
+            for number, text in blocks.items():
+                i = pending[number - 1]
+                responses[i] = text
+                # Cache each answer under its own prompt for the single-prompt paths
+                store_response(prompts[i - 1], model, text)
+    
+    # Fall back to individual calls for any prompt the batch did not answer
+    missing = [i for i, text in responses.items() if not text]
+    if missing:
+        responses.update(zip(missing, gather_llama2([prompts[i - 1] for i in missing], model)))
+    return [responses[i] for i in range(1, len(prompts) + 1)]
 
-def read_pdf(file):
-    """Extract text from PDF with error handling"""
+def extract_pdfplumber_pages(data, page_numbers):
+    """Extract text from a range of pages with pdfplumber"""
+    # pdfplumber documents are not thread-safe, so each worker opens its own
+    texts = []
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        for i in page_numbers:
+            page = pdf.pages[i]
+            texts.append(page.extract_text() or "")
+            # Drop the page's cached layout objects once its text is taken
+            page.close()
+    return texts
+
+def read_pdf(data):
+    """Extract text from PDF bytes with error handling"""
     try:
-        with pdfplumber.open(file) as pdf:
-            return "\n".join(page.extract_text() for page in pdf.pages if page.extract_text())
+        if pymupdf is not None:
+            with pymupdf.open(stream=data, filetype="pdf") as doc:
+                return "\n".join(text for text in (page.get_text("text") for page in doc) if text)
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            page_count = len(pdf.pages)
+        if not page_count:
+            return ""
+        
+        # Split pages into contiguous ranges so executor.map keeps page order
+        workers = min(os.cpu_count() or 1, page_count)
+        chunk_size = -(-page_count // workers)
+        page_ranges = [range(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunks = executor.map(partial(extract_pdfplumber_pages, data), page_ranges)
+            return "\n".join(text for chunk in chunks for text in chunk if text)
     except Exception as e:
         st.error(f"PDF reading error: {e}")
         return None
 
+# Cached loaders - keyed on the uploaded file's bytes so reruns skip re-parsing
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_csv(data):
+    """Parse CSV bytes into a DataFrame"""
+    try:
+        # Multithreaded Arrow parser; columns stay NumPy-backed so the
+        # object/category checks used for plotting still find text columns
+        data_frame = pd.read_csv(io.BytesIO(data), engine="pyarrow")
+    except Exception:
+        # pyarrow is missing or rejected the file (e.g. ragged rows)
+        return pd.read_csv(io.BytesIO(data))
+    # pyarrow keeps duplicate and empty headers as-is; the default engine
+    # renames them (a.1, Unnamed: 0), which the rest of the app relies on
+    if not data_frame.columns.is_unique or "" in data_frame.columns:
+        return pd.read_csv(io.BytesIO(data))
+    
+    # pyarrow also infers dates and times the default engine leaves as text;
+    # re-read just those columns with the default engine to keep them as before
+    temporal_cols = []
+    for c in data_frame.columns:
+        column = data_frame[c]
+        if column.dtype.kind == "M":
+            temporal_cols.append(c)
+        elif column.dtype == object:
+            # Arrow date/time columns arrive as object columns of date/time values
+            first = column.first_valid_index()
+            if first is not None and isinstance(column[first], (datetime.date, datetime.time)):
+                temporal_cols.append(c)
+    if temporal_cols:
+        as_text = pd.read_csv(io.BytesIO(data), usecols=temporal_cols)
+        if len(as_text) != len(data_frame):
+            return pd.read_csv(io.BytesIO(data))
+        data_frame[temporal_cols] = as_text[temporal_cols]
+    return data_frame
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_xlsx(data):
+    """Parse Excel bytes into a DataFrame"""
+    try:
+        # Rust-based reader, much faster than openpyxl's pure Python XML parsing
+        return pd.read_excel(io.BytesIO(data), engine='calamine')
+    except ImportError:
+        # python-calamine is not installed; openpyxl handles the same files
+        return pd.read_excel(io.BytesIO(data), engine='openpyxl')
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_pdf_text(data):
+    """Extract text from PDF bytes"""
+    return read_pdf(data)
+
+# Document map-reduce - ~2.5k tokens per chunk at ~4 characters per token
+PDF_CHUNK_CHARS = 10000
+PDF_REDUCE_CHARS = 15000
+
+def split_text(text, max_chars=PDF_CHUNK_CHARS, separators=("\n\n", "\n", ". ", " ")):
+    """Recursively split text at the coarsest boundary that keeps chunks under max_chars"""
+    if len(text) <= max_chars:
+        return [text] if text.strip() else []
+    for i, sep in enumerate(separators):
+        parts = text.split(sep)
+        if len(parts) > 1:
+            break
+    else:
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+    
+    chunks, current = [], ""
+    for part in parts:
+        candidate = current + sep + part if current else part
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current.strip():
+            chunks.append(current)
+        current = ""
+        if len(part) > max_chars:
+            chunks.extend(split_text(part, max_chars, separators[i + 1:]))
+        else:
+            current = part
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+# Chunk summaries kept per process, shared by all sessions
+CHUNK_SUMMARY_ENTRIES = 512
+
+@st.cache_resource(show_spinner=False)
+def chunk_summary_cache():
+    """Chunk summaries keyed on a hash of model and chunk text, least recently used evicted"""
+    return LRUCache(maxsize=CHUNK_SUMMARY_ENTRIES), threading.Lock()
+
+def summarize_chunks(chunks, model=LLM_MODEL):
+    """Map step: summarize chunks concurrently, reusing summaries of unchanged chunks"""
+    cache, lock = chunk_summary_cache()
+    keys = [hashlib.sha256(f"{model}\n{chunk}".encode("utf-8")).hexdigest() for chunk in chunks]
+    with lock:
+        summaries = [cache.get(key) for key in keys]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if missing:
+        prompts = [
+            f"Summarize this section of a document, keeping its key points, topics and any notable figures:\n\n{chunks[i]}"
+            for i in missing
+        ]
+        for i, summary in zip(missing, gather_llama2(prompts, model)):
+            summaries[i] = summary
+            if summary:
+                with lock:
+                    cache[keys[i]] = summary
+    return summaries
+
+def condense_document(text, model=LLM_MODEL):
+    """Summarize chunks until the text fits PDF_REDUCE_CHARS; returns (content, summarized)"""
+    summarized = False
+    while len(text) > PDF_REDUCE_CHARS:
+        summaries = summarize_chunks(split_text(text), model)
+        if not all(summaries):
+            return None, False
+        condensed = "\n\n".join(summaries)
+        summarized = True
+        if len(condensed) >= len(text):
+            # Summaries stopped shrinking; use them whole rather than cut them
+            return condensed, summarized
+        text = condensed
+    return text, summarized
+
+# Prompt builders
+def dataset_key(data_frame, dataset_id):
+    """Cheap cache key for a loaded dataset: upload id, schema and shape"""
+    return (dataset_id, tuple(data_frame.columns), tuple(data_frame.dtypes.astype(str)), data_frame.shape)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def df_profile(_data_frame, key):
+    """Column dtypes, null counts and numeric/categorical columns, computed once per dataset"""
+    return {
+        "dtypes": _data_frame.dtypes.astype(str).to_dict(),
+        "nulls": (_data_frame.shape[0] - _data_frame.count()).to_dict(),
+        "numeric": _data_frame.select_dtypes(include=['number']).columns.tolist(),
+        "cat": _data_frame.select_dtypes(include=['object', 'category']).columns.tolist()
+    }
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def prompt_context(_data_frame, key):
+    """Compact schema, CSV sample and null counts for prompts, computed once per dataset"""
+    profile = df_profile(_data_frame, key)
+    return {
+        "schema": "\n".join(f"{c}:{t}" for c, t in profile["dtypes"].items()),
+        "sample_csv": _data_frame.head(3).to_csv(index=False),
+        "null_counts": pd.Series(profile["nulls"]).to_string()
+    }
+
+def build_eda_prompt(data_frame, key):
+    """Build the automated EDA summary prompt for a dataset"""
+    context = prompt_context(data_frame, key)
+    
+    return f"""Analyze this dataset and provide a structured report:
+    
+    Dataset Overview:
+    - Shape: {data_frame.shape}
+    - Columns (name:type):
+{context['schema']}
+    - Sample Rows (CSV):
+{context['sample_csv']}
+    Please provide:
+    1. Data Quality Assessment (missing values, duplicates)
+    2. Statistical Summary (for numeric columns)
+    3. Interesting Patterns/Observations
+    4. Recommendations for:
+       - Data Cleaning
+       - Further Analysis
+       - Potential Visualizations
+    
+    Keep the response concise and structured with clear headings."""
+
+def build_qa_prompt(data_frame, key, user_question):
+    """Build the question-answering prompt for a dataset"""
+    context = prompt_context(data_frame, key)
+    
+    return f"""You are a data analyst assistant. Answer the following question about the dataset:
+    
+    Question: {user_question}
+    
+    Dataset Context:
+    - Columns (name:type):
+{context['schema']}
+    - Sample Data (CSV):
+{context['sample_csv']}
+    - Null Values Count:
+{context['null_counts']}
+    
+    Provide:
+    1. A clear answer to the question
+    2. Relevant statistics if applicable
+    3. Any caveats or limitations in the data
+    4. Suggestions for further analysis if relevant
+    
+    If the question cannot be answered with the available data, explain why."""
+
+# Plot helpers - keep the points sent to the browser bounded on large frames
+MAX_PLOT_POINTS = 50000
+MAX_LINE_POINTS = 5000
+
+def sample_positions(length, size, seed=None):
+    """Distinct random row positions, without permuting the whole index like df.sample"""
+    return np.random.default_rng(seed).choice(length, size=min(size, length), replace=False)
+
+def downsample_rows(data_frame, max_points=MAX_PLOT_POINTS):
+    """Random row sample (in original order) when a frame exceeds max_points"""
+    if len(data_frame) <= max_points:
+        return data_frame
+    return data_frame.take(np.sort(sample_positions(len(data_frame), max_points, seed=0)))
+
+def downsample_line(data_frame, x_axis, y_axis, color_col=None, max_points=MAX_LINE_POINTS):
+    """Cap the points of every line trace, using LTTB when tsdownsample is available"""
+    traces = data_frame.groupby(color_col, sort=False, dropna=False, observed=True) if color_col else [(None, data_frame)]
+    kept = []
+    for _, trace in traces:
+        if len(trace) <= max_points:
+            kept.append(trace)
+            continue
+        index = None
+        x_values = trace[x_axis]
+        y_values = trace[y_axis]
+        if (
+            MinMaxLTTBDownsampler is not None
+            and (pd.api.types.is_numeric_dtype(x_values) or pd.api.types.is_datetime64_any_dtype(x_values))
+            and x_values.is_monotonic_increasing
+            and not (x_values.isna().any() or y_values.isna().any())
+        ):
+            x_array = x_values.to_numpy()
+            if x_array.dtype.kind == "M":
+                x_array = x_array.view("int64")
+            try:
+                index = MinMaxLTTBDownsampler().downsample(x_array, y_values.to_numpy(), n_out=max_points)
+            except Exception:
+                index = None
+        if index is None:
+            index = np.linspace(0, len(trace) - 1, max_points).astype(int)
+        kept.append(trace.iloc[index])
+    return pd.concat(kept) if len(kept) > 1 else kept[0]
+
+def prebinned_histogram(data_frame, x_axis, max_bins=200):
+    """Bin a numeric column server-side and draw the bins as bars (None if nothing to bin)"""
+    values = data_frame[x_axis].dropna().to_numpy(dtype=float)
+    # +/-inf cannot be binned (edge detection rejects them), so leave them out
+    values = values[np.isfinite(values)]
+    if not values.size:
+        return None
+    edges = np.histogram_bin_edges(values, bins="auto")
+    if len(edges) > max_bins + 1:
+        edges = np.histogram_bin_edges(values, bins=max_bins)
+    counts, edges = np.histogram(values, bins=edges)
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges)))
+    fig.update_layout(bargap=0, xaxis_title=x_axis, yaxis_title="count")
+    return fig
+
+# Rows above which text columns used for grouping are sent as categories
+CATEGORY_COERCE_ROWS = 100000
+
+def plot_columns(data_frame, x_axis, y_axis, color_col, facet_col):
+    """Slice out only the columns a chart uses so the rest are never serialized"""
+    used = list(dict.fromkeys(c for c in (x_axis, y_axis, color_col, facet_col) if c is not None))
+    plot_frame = data_frame[used]
+    if len(plot_frame) > CATEGORY_COERCE_ROWS:
+        grouping = [c for c in dict.fromkeys((color_col, facet_col)) if c is not None and plot_frame[c].dtype == object]
+        if grouping:
+            plot_frame = plot_frame.astype({c: "category" for c in grouping})
+    return plot_frame
+
+# UI sections
+# Selectors list at most this many columns; wider frames are searched
+MAX_SELECT_OPTIONS = 500
+
+def limit_options(options, query, limit=MAX_SELECT_OPTIONS):
+    """Filter column options by a case-insensitive search and cap the list length"""
+    if query:
+        query = query.lower()
+        options = [c for c in options if query in str(c).lower()]
+    return options[:limit]
+
+def keep_selections(options, all_options, keys):
+    """Put the current selectbox choices back into a filtered option list"""
+    kept = [
+        st.session_state[key] for key in keys
+        if st.session_state.get(key) in all_options and st.session_state[key] not in options
+    ]
+    return list(dict.fromkeys(kept)) + options
+
+# Larger reports are only embedded when asked for; they are always downloadable
+PROFILE_INLINE_LIMIT = 1024 * 1024
+# Generated reports kept on disk per session
+PROFILE_CACHE_ENTRIES = 4
+
+def show_profile_report(report_path, requested=False):
+    """Embed a generated profile report and offer it for download from disk"""
+    report_size = os.path.getsize(report_path)
+    # Small reports open with the click that asked for them; on other reruns
+    # the report is only read and embedded while the preview is ticked
+    if (requested and report_size <= PROFILE_INLINE_LIMIT) or st.checkbox(
+        f"Show report preview ({report_size / (1024 * 1024):.1f} MB)"
+    ):
+        with open(report_path, "r", encoding="utf-8") as f:
+            st.components.v1.html(f.read(), width=1000, height=1200, scrolling=True)
+    
+    def read_report():
+        with open(report_path, "rb") as f:
+            return f.read()
+    
+    # A callable is only invoked when the button is clicked
+    st.download_button(
+        "Download Full Report",
+        read_report,
+        "data_profile.html",
+        "text/html"
+    )
+
+@st.fragment
+def viz_fragment(data_frame, column_info):
+    """Chart builder; widget changes here rerun only this fragment"""
+    # Visualization Section
+    st.subheader("📊 Interactive Visualizations")
+    vis_col1, vis_col2 = st.columns(2)
+    
+    with vis_col1:
+        all_cols = data_frame.columns.tolist()
+        numeric_cols = column_info["numeric"]
+        cat_cols = column_info["cat"]
+        
+        # Wide frames get a search box instead of listing every column
+        if len(all_cols) > MAX_SELECT_OPTIONS:
+            column_search = st.text_input("Search columns")
+            # The current choices stay listed, so searching for the Y column
+            # does not reset the X column that was picked before
+            all_cols, numeric_cols, cat_cols = (
+                keep_selections(limit_options(cols, column_search), cols, keys)
+                for cols, keys in (
+                    (all_cols, ["viz_x"]),
+                    (numeric_cols, ["viz_y"]),
+                    (cat_cols, ["viz_color", "viz_facet"])
+                )
+            )
+            st.caption(f"Lists show at most {MAX_SELECT_OPTIONS} matching columns per selector")
+            if not all_cols:
+                st.info("No columns match")
+                return
+        
+        plot_type = st.selectbox(
+            "Select visualization type",
+            ["Histogram", "Box Plot", "Scatter Plot", "Bar Chart", "Line Chart"]
+        )
+        
+        x_axis = st.selectbox("X-axis", all_cols, key="viz_x")
+        y_axis = st.selectbox("Y-axis", numeric_cols if numeric_cols else [None], key="viz_y")
+
+    with vis_col2:
+        color_col = st.selectbox("Color by (optional)", [None] + cat_cols, key="viz_color")
+        facet_col = st.selectbox("Facet by (optional)", [None] + cat_cols, key="viz_facet")
+        
+        if st.button("Generate Visualization"):
+            try:
+                fig = None
+                plot_frame = plot_columns(data_frame, x_axis, y_axis, color_col, facet_col)
+                if plot_type == "Histogram":
+                    if (
+                        color_col is None and facet_col is None
+                        and pd.api.types.is_numeric_dtype(plot_frame[x_axis])
+                        and not pd.api.types.is_bool_dtype(plot_frame[x_axis])
+                    ):
+                        fig = prebinned_histogram(plot_frame, x_axis)
+                    if fig is None:
+                        fig = px.histogram(plot_frame, x=x_axis, color=color_col, facet_col=facet_col)
+                elif plot_type == "Box Plot":
+                    fig = px.box(plot_frame, x=x_axis, y=y_axis, color=color_col)
+                elif plot_type == "Scatter Plot" and y_axis:
+                    fig = px.scatter(downsample_rows(plot_frame), x=x_axis, y=y_axis, color=color_col, render_mode="webgl")
+                elif plot_type == "Bar Chart":
+                    fig = px.bar(plot_frame, x=x_axis, y=y_axis if y_axis else None, color=color_col)
+                elif plot_type == "Line Chart" and y_axis:
+                    fig = px.line(
+                        downsample_line(plot_frame, x_axis, y_axis, color_col),
+                        x=x_axis, y=y_axis, color=color_col, render_mode="webgl"
+                    )
+                
+                if fig:
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.warning("Could not generate the selected visualization with current parameters")
+            except Exception as e:
+                st.error(f"Visualization error: {e}")
+
+# Not a fragment: fragment reruns are queued behind a running script instead
+# of interrupting it, which would stop pending requests from being merged
+def ai_section(data_frame, dataset_id, data_key):
+    """EDA summary and QA tabs"""
+    # AI Analysis Section
+    st.subheader("🤖 AI-Powered Analysis")
+    
+    tab1, tab2 = st.tabs(["Automated EDA Summary", "Ask Questions"])
+    
+    # Requests stay pending across reruns, so clicking another button while
+    # one is still running sends both together instead of dropping the first
+    ai_pending = st.session_state.setdefault("ai_pending", {})
+    ai_results = st.session_state.setdefault("ai_results", {})
+    
+    with tab1:
+        if st.button("Generate AI Summary"):
+            ai_pending["eda"] = ((dataset_id, None), build_eda_prompt(data_frame, data_key))
+            pending_question = st.session_state.get("qa_question", "").strip()
+            answered = ai_results.get("qa", (None,))[0] == (dataset_id, pending_question)
+            if pending_question and not answered:
+                # Answer the pending question in the same request
+                ai_pending["qa"] = ((dataset_id, pending_question), build_qa_prompt(data_frame, data_key, pending_question))
+    
+    with tab2:
+        user_question = st.text_area("Ask anything about your data", height=100, key="qa_question")
+        if user_question and st.button("Get Answer"):
+            ai_pending["qa"] = ((dataset_id, user_question.strip()), build_qa_prompt(data_frame, data_key, user_question))
+    
+    ai_tabs = {
+        "eda": (tab1, "### 📝 AI-Generated EDA Summary", "Failed to generate EDA summary"),
+        "qa": (tab2, "### 🤖 Analysis Results", "Failed to get answer")
+    }
+    streamed = set()
+    answers = {}
+    if len(ai_pending) == 1:
+        name, (_, prompt) = next(iter(ai_pending.items()))
+        tab, header, _ = ai_tabs[name]
+        with tab:
+            with st.spinner("Analyzing data with AI..."):
+                st.markdown(header)
+                answers[name] = write_llama2_stream(prompt)
+        streamed.add(name)
+    elif ai_pending:
+        with st.spinner("Analyzing data with AI..."):
+            names = list(ai_pending)
+            answers = dict(zip(names, batch_llama2([ai_pending[n][1] for n in names])))
+    
+    for name, answer in answers.items():
+        if answer:
+            ai_results[name] = (ai_pending[name][0], answer)
+        else:
+            ai_results.pop(name, None)
+            with ai_tabs[name][0]:
+                st.error(ai_tabs[name][2])
+    ai_pending.clear()
+    
+    # Results are only shown for the dataset (and question) they answer
+    current_keys = {"eda": (dataset_id, None), "qa": (dataset_id, user_question.strip())}
+    for name, (tab, header, _) in ai_tabs.items():
+        if name in streamed or name not in ai_results:
+            continue
+        key, answer = ai_results[name]
+        if key != current_keys[name]:
+            continue
+        with tab:
+            st.markdown(header)
+            st.markdown(answer)
+
 # UI Components
 st.title("📊 AI-Powered Data Insights & Visualization Assistant")
 uploaded_file = st.file_uploader(
@@ -76,30 +731,37 @@ uploaded_file = st.file_uploader(
 if uploaded_file is not None:
     file_extension = uploaded_file.name.split('.')[-1].lower()
     data_frame = None
+    file_bytes = uploaded_file.getvalue()
     
     try:
         if file_extension == 'csv':
-            data_frame = pd.read_csv(uploaded_file)
+            data_frame = load_csv(file_bytes)
         elif file_extension == 'xlsx':
-            data_frame = pd.read_excel(uploaded_file, engine='openpyxl')
+            data_frame = load_xlsx(file_bytes)
         elif file_extension == 'pdf':
-            pdf_text = read_pdf(uploaded_file)
+            pdf_text = load_pdf_text(file_bytes)
             if pdf_text:
                 with st.expander("📄 Extracted PDF Content"):
                     st.text(pdf_text[:5000] + ("..." if len(pdf_text) > 5000 else ""))
                 
                 if st.button("Analyze PDF Content"):
                     with st.spinner("Analyzing document..."):
-                        analysis_prompt = f"""Please analyze this document and provide:
-                        1. A concise summary of key points
-                        2. Main topics covered
-                        3. Any notable patterns or insights
-
-                        Document content:\n{pdf_text[:15000]}"""
-                        analysis = call_llama2(analysis_prompt)
-                        if analysis:
+                        # Long documents are summarized section by section first
+                        document_content, summarized = condense_document(pdf_text)
+                        if document_content is None:
+                            st.error("Failed to analyze document")
+                        else:
+                            source = "Summaries of consecutive document sections" if summarized else "Document content"
+                            analysis_prompt = f"""Please analyze this document and provide:
+                            1. A concise summary of key points
+                            2. Main topics covered
+                            3. Any notable patterns or insights
+
+                            {source}:\n{document_content}"""
                             st.markdown("### 📝 Document Analysis")
-                            st.write(analysis)
+                            analysis = write_llama2_stream(analysis_prompt)
+                            if not analysis:
+                                st.error("Failed to analyze document")
             # Skip visualization for PDFs
     except Exception as e:
         st.error(f"Error processing file: {e}")
@@ -107,6 +769,10 @@ if uploaded_file is not None:
 
     # Only show data analysis if we have a dataframe (CSV/Excel)
     if data_frame is not None:
+        dataset_id = uploaded_file.file_id
+        data_key = dataset_key(data_frame, dataset_id)
+        column_info = df_profile(data_frame, data_key)
+        
         # Basic Info Section
         st.success(f"✅ Successfully loaded {uploaded_file.name} ({data_frame.shape[0]} rows, {data_frame.shape[1]} columns)")
         
@@ -115,143 +781,64 @@ if uploaded_file is not None:
             
             if st.checkbox("Show random samples"):
                 sample_size = st.slider("Sample size", 1, 100, 10)
-                st.dataframe(data_frame.sample(sample_size), use_container_width=True)
+                st.dataframe(data_frame.take(sample_positions(len(data_frame), sample_size)), use_container_width=True)
 
         # Data Profiling Section
         st.subheader("📈 Automated Data Profiling")
-        if st.button("Generate Full Profile Report"):
+        fast_profile = st.toggle(
+            "Fast profile",
+            value=False,
+            help="Skip correlations, interactions and samples. Turn off for the full explorative report."
+        )
+        # Reports are kept per dataset and mode, so asking again reuses the file
+        profile_reports = st.session_state.setdefault("profile_reports", {})
+        report_key = (data_key, fast_profile)
+        report_path = profile_reports.get(report_key)
+        if report_path and not os.path.exists(report_path):
+            report_path = None
+        elif report_path:
+            # Move the report to the end so the least recently used goes first
+            profile_reports[report_key] = profile_reports.pop(report_key)
+        
+        report_requested = st.button("Generate Full Profile Report")
+        if report_requested and report_path is None:
             with st.spinner("Generating comprehensive profile..."):
                 try:
-                    profile = ProfileReport(data_frame, title="Dataset Profile", explorative=True)
+                    # Imported on first use; it takes seconds to load and slows cold starts
+                    from ydata_profiling import ProfileReport
                     
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".html") as tmpfile:
-                        profile.to_file(tmpfile.name)
-                        with open(tmpfile.name, "r", encoding="utf-8") as f:
-                            html_content = f.read()
+                    if fast_profile:
+                        profile = ProfileReport(
+                            data_frame,
+                            title="Dataset Profile",
+                            minimal=True,
+                            correlations=None,
+                            interactions=None,
+                            samples=None
+                        )
+                    else:
+                        profile = ProfileReport(data_frame, title="Dataset Profile", explorative=True)
                     
-                    st.components.v1.html(html_content, width=1000, height=1200, scrolling=True)
+                    # One temp directory per session; it is removed with the
+                    # session state when the session ends (or at exit)
+                    if "profile_dir" not in st.session_state:
+                        st.session_state["profile_dir"] = tempfile.TemporaryDirectory(prefix="ai_fyp_profiles_")
+                    profile_dir = st.session_state["profile_dir"].name
+                    with tempfile.NamedTemporaryFile(dir=profile_dir, delete=False, suffix=".html") as tmpfile:
+                        new_report_path = tmpfile.name
+                    profile.to_file(new_report_path)
+                    report_path = profile_reports[report_key] = new_report_path
                     
-                    with open(tmpfile.name, "rb") as f:
-                        st.download_button(
-                            "Download Full Report",
-                            f.read(),
-                            "data_profile.html",
-                            "text/html"
-                        )
-                    os.unlink(tmpfile.name)
+                    # Bound the reports kept on disk, dropping the least recently used
+                    while len(profile_reports) > PROFILE_CACHE_ENTRIES:
+                        old_report_path = profile_reports.pop(next(iter(profile_reports)))
+                        if os.path.exists(old_report_path):
+                            os.unlink(old_report_path)
                 except Exception as e:
                     st.error(f"Profile generation failed: {e}")
-
-        # Visualization Section
-        st.subheader("📊 Interactive Visualizations")
-        vis_col1, vis_col2 = st.columns(2)
         
-        with vis_col1:
-            numeric_cols = data_frame.select_dtypes(include=['number']).columns.tolist()
-            cat_cols = data_frame.select_dtypes(include=['object', 'category']).columns.tolist()
-            
-            plot_type = st.selectbox(
-                "Select visualization type",
-                ["Histogram", "Box Plot", "Scatter Plot", "Bar Chart", "Line Chart"]
-            )
-            
-            x_axis = st.selectbox("X-axis", data_frame.columns)
-            y_axis = st.selectbox("Y-axis", numeric_cols if numeric_cols else [None])
-
-        with vis_col2:
-            color_col = st.selectbox("Color by (optional)", [None] + cat_cols)
-            facet_col = st.selectbox("Facet by (optional)", [None] + cat_cols)
-            
-            if st.button("Generate Visualization"):
-                try:
-                    fig = None
-                    if plot_type == "Histogram":
-                        fig = px.histogram(data_frame, x=x_axis, color=color_col, facet_col=facet_col)
-                    elif plot_type == "Box Plot":
-                        fig = px.box(data_frame, x=x_axis, y=y_axis, color=color_col)
-                    elif plot_type == "Scatter Plot" and y_axis:
-                        fig = px.scatter(data_frame, x=x_axis, y=y_axis, color=color_col)
-                    elif plot_type == "Bar Chart":
-                        fig = px.bar(data_frame, x=x_axis, y=y_axis if y_axis else None, color=color_col)
-                    elif plot_type == "Line Chart" and y_axis:
-                        fig = px.line(data_frame, x=x_axis, y=y_axis, color=color_col)
-                    
-                    if fig:
-                        st.plotly_chart(fig, use_container_width=True)
-                    else:
-                        st.warning("Could not generate the selected visualization with current parameters")
-                except Exception as e:
-                    st.error(f"Visualization error: {e}")
+        if report_path:
+            show_profile_report(report_path, report_requested)
 
-        # AI Analysis Section
-        st.subheader("🤖 AI-Powered Analysis")
-        
-        tab1, tab2 = st.tabs(["Automated EDA Summary", "Ask Questions"])
-        
-        with tab1:
-            if st.button("Generate AI Summary"):
-                with st.spinner("Analyzing data with AI..."):
-                    # Prepare dataset sample
-                    sample_data = data_frame.head(3).to_dict(orient='records')
-                    
-                    eda_prompt = f"""Analyze this dataset and provide a structured report:
-                    
-                    Dataset Overview:
-                    - Shape: {data_frame.shape}
-                    - Columns: {list(data_frame.columns)}
-                    - Sample Rows: {sample_data}
-                    
-                    Please provide:
-                    1. Data Quality Assessment (missing values, duplicates)
-                    2. Statistical Summary (for numeric columns)
-                    3. Interesting Patterns/Observations
-                    4. Recommendations for:
-                       - Data Cleaning
-                       - Further Analysis
-                       - Potential Visualizations
-                    
-                    Keep the response concise and structured with clear headings."""
-                    
-                    response = call_llama2(eda_prompt)
-                    if response:
-                        st.markdown("### 📝 AI-Generated EDA Summary")
-                        st.markdown(response)
-                    else:
-                        st.error("Failed to generate EDA summary")
-        
-        with tab2:
-            user_question = st.text_area("Ask anything about your data", height=100)
-            if user_question and st.button("Get Answer"):
-                with st.spinner("Analyzing your question..."):
-                    # Prepare context
-                    context = {
-                        "columns": list(data_frame.columns),
-                        "dtypes": data_frame.dtypes.astype(str).to_dict(),
-                        "sample": data_frame.head(3).to_dict(orient='records'),
-                        "null_counts": data_frame.isnull().sum().to_dict()
-                    }
-                    
-                    qa_prompt = f"""You are a data analyst assistant. Answer the following question about the dataset:
-                    
-                    Question: {user_question}
-                    
-                    Dataset Context:
-                    - Columns: {context['columns']}
-                    - Data Types: {context['dtypes']}
-                    - Sample Data: {context['sample']}
-                    - Null Values Count: {context['null_counts']}
-                    
-                    Provide:
-                    1. A clear answer to the question
-                    2. Relevant statistics if applicable
-                    3. Any caveats or limitations in the data
-                    4. Suggestions for further analysis if relevant
-                    
-                    If the question cannot be answered with the available data, explain why."""
-                    
-                    answer = call_llama2(qa_prompt)
-                    if answer:
-                        st.markdown("### 🤖 Analysis Results")
-                        st.markdown(answer)
-                    else:
-                        st.error("Failed to
+        viz_fragment(data_frame, column_info)
+        ai_section(data_frame, dataset_id, data_key)